@@ -10,184 +10,270 @@ except ImportError:
         import pyreadline as readline
     except ImportError:
         import readline
+import bisect
+import functools
+import re
+import signal
 import time
+from collections import deque
+from itertools import islice
 from typing import List
 
+_HAVE_POSIX_SPAWN = hasattr(os, "posix_spawn")
+# Signals subprocess resets to SIG_DFL in children (restore_signals=True);
+# spawned children must not inherit CPython's SIG_IGN for these through exec.
+_SPAWN_SETSIGDEF = tuple(getattr(signal, name)
+                         for name in ("SIGPIPE", "SIGXFZ", "SIGXFSZ")
+                         if hasattr(signal, name))
+
 # --- Configuration / builtins ------------------------------------------------
 builtins = ["echo", "exit", "type", "pwd", "cd", "history"]
+_builtin_set = frozenset(builtins)
 
 # --- History storage and append tracking -------------------------------------
-history_list: List[str] = []
-last_append_idx = 0  # index in history_list up to which appended to last -a write
+# History is bounded by HISTSIZE; the deque drops oldest entries itself.
+# Save bookkeeping uses a monotonic append counter instead of positions so
+# rotation of the deque cannot desync it.
+try:
+    _histsize = int(os.environ.get("HISTSIZE", "10000"))
+except ValueError:
+    _histsize = 10000
+# As in bash, a negative HISTSIZE means unlimited history.
+history_list: deque = deque(maxlen=_histsize if _histsize >= 0 else None)
+history_total = 0    # monotonic count of entries ever recorded
+last_append_idx = 0  # history_total as of the last -a write
+last_saved_idx = 0   # history_total as of the last HISTFILE save
+
+def record_history(entry: str):
+    global history_total
+    history_list.append(entry)
+    history_total += 1
+
+def _history_since(counter: int):
+    """Entries recorded after `counter`, minus any the deque already dropped."""
+    dropped = history_total - len(history_list)
+    return islice(history_list, max(0, counter - dropped), None)
+
+def save_history_tail(histfile):
+    """Append only the entries added since the last save, in one write."""
+    global last_saved_idx
+    if not histfile:
+        return
+    new_entries = list(_history_since(last_saved_idx))
+    if not new_entries:
+        return
+    try:
+        with open(histfile, "a") as f:
+            f.write("\n".join(new_entries) + "\n")
+        last_saved_idx = history_total
+    except Exception:
+        pass
 
 # --- Utilities ---------------------------------------------------------------
-def find_executable(cmd: str):
-    path_env = os.environ.get("PATH", "")
-    for directory in path_env.split(os.pathsep):
-        if not directory:
-            continue
-        full_path = os.path.join(directory, cmd)
-        if os.path.isfile(full_path) and os.access(full_path, os.X_OK):
-            return full_path
-    return None
+# Snapshot of PATH and cwd for the current prompt tick. Refreshed before each
+# input() and after cd, so completer callbacks and dispatch don't re-query the
+# environ proxy or issue getcwd(2) several times per keystroke.
+_tick_path = None
+_tick_cwd = None
+
+def _refresh_tick():
+    global _tick_path, _tick_cwd
+    _tick_path = os.environ.get("PATH", "")
+    try:
+        _tick_cwd = os.getcwd()
+    except OSError:
+        _tick_cwd = None
+
+_which_cache = {}  # (cmd, PATH) -> (resolved path or None, timestamp)
+_path_walker = None       # lookup closure specialized for _path_walker_path
+_path_walker_path = None
+
+def _make_path_walker(path_env: str):
+    # PATH rarely changes within a session: bake the split directory list
+    # into a closure and bind the os helpers as default-arg locals so the
+    # hot loop runs on LOAD_FAST instead of global lookups per call.
+    dirs = [d for d in path_env.split(os.pathsep) if d]
+    def walk(cmd, _dirs=dirs, _join=os.path.join,
+             _isfile=os.path.isfile, _access=os.access, _x_ok=os.X_OK):
+        for directory in _dirs:
+            full_path = _join(directory, cmd)
+            if _isfile(full_path) and _access(full_path, _x_ok):
+                return full_path
+        return None
+    return walk
 
-_exec_cache = {"names": None, "ts": 0.0, "ttl": 1.0}
+def find_executable(cmd: str):
+    global _path_walker, _path_walker_path
+    path_env = _tick_path if _tick_path is not None else os.environ.get("PATH", "")
+    key = (cmd, path_env)
+    cached = _which_cache.get(key)
+    now = time.time()
+    if cached is not None and (now - cached[1] < _exec_cache["ttl"]):
+        return cached[0]
+    if path_env is not _path_walker_path and path_env != _path_walker_path:
+        _path_walker = _make_path_walker(path_env)
+        _path_walker_path = path_env
+    result = _path_walker(cmd)
+    # Cache negative results too so repeated "command not found" is fast.
+    _which_cache[key] = (result, now)
+    return result
+
+_dir_cache = {}  # directory -> (st_mtime_ns, executable names in it)
+_exec_cache = {"path": None, "names": None, "ts": 0.0, "ttl": 1.0}
 def get_path_executables():
     now = time.time()
-    if _exec_cache["names"] is not None and (now - _exec_cache["ts"] < _exec_cache["ttl"]):
+    path_env = _tick_path if _tick_path is not None else os.environ.get("PATH", "")
+    if (_exec_cache["names"] is not None and _exec_cache["path"] == path_env
+            and now - _exec_cache["ts"] < _exec_cache["ttl"]):
         return _exec_cache["names"]
-    path_env = os.environ.get("PATH", "")
     executable_names = set()
     for directory in path_env.split(os.pathsep):
-        if not directory or not os.path.isdir(directory):
+        if not directory:
             continue
         try:
-            for fname in os.listdir(directory):
-                fpath = os.path.join(directory, fname)
-                if os.path.isfile(fpath) and os.access(fpath, os.X_OK):
-                    executable_names.add(fname)
-        except Exception:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
             continue
+        cached = _dir_cache.get(directory)
+        if cached is not None and cached[0] == mtime:
+            names = cached[1]
+        else:
+            # Directory changed (or first visit): rescan just this one.
+            names = []
+            try:
+                # scandir reuses the stat info from the directory read itself,
+                # so is_file costs no extra syscall per entry.
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=True) and os.access(entry.path, os.X_OK):
+                            names.append(entry.name)
+            except Exception:
+                names = []
+            _dir_cache[directory] = (mtime, names)
+        executable_names.update(names)
     names = sorted(executable_names)
+    _exec_cache["path"] = path_env
     _exec_cache["names"] = names
     _exec_cache["ts"] = now
     return names
 
 def longest_common_prefix(strs: List[str]) -> str:
-    if not strs:
-        return ""
-    min_len = min(len(s) for s in strs)
-    lcp_chars = []
-    for i in range(min_len):
-        c = strs[0][i]
-        if all(s[i] == c for s in strs):
-            lcp_chars.append(c)
-        else:
+    if len(strs) <= 2:
+        return os.path.commonprefix(strs)
+    # The LCP of a whole set equals the LCP of its lexicographic min and max.
+    # Encode those two as UTF-32 (fixed 4 bytes/char, so no partial-character
+    # boundaries) and XOR 32-byte chunks; count-trailing-zeros on the first
+    # nonzero XOR locates the first differing byte, 8 chars per iteration.
+    lo = min(strs)
+    hi = max(strs)
+    a = lo.encode("utf-32-le", "surrogatepass")
+    b = hi.encode("utf-32-le", "surrogatepass")
+    n = min(len(a), len(b))
+    shared = n
+    for i in range(0, n, 32):
+        x = (int.from_bytes(a[i:i + 32], "little")
+             ^ int.from_bytes(b[i:i + 32], "little"))
+        if x:
+            shared = i + (((x & -x).bit_length() - 1) >> 3)
             break
-    return "".join(lcp_chars)
+    return lo[:shared >> 2]
 
 # --- Command-line parsing ---------------------------------------------------
-def parse_command_line(line: str) -> List[str]:
+# A token is a maximal run of single-quoted, double-quoted, backslash-escaped
+# and plain segments with no whitespace between them. Both patterns tolerate
+# unterminated quotes and a trailing backslash the same way the old
+# char-at-a-time loop did: the rest of the line belongs to the token.
+_TOKEN_RE = re.compile(r"""(?:'[^']*'?|"(?:\\.|[^"\\])*["\\]?|\\.?|[^\s'"\\]+)+""")
+_SEGMENT_RE = re.compile(r"""'([^']*)'?|"((?:\\.|[^"\\])*)["\\]?|(\\.?|[^\s'"\\]+)""")
+
+# Inside double quotes only \" \\ \$ \` are escapes; any other \x stays.
+_DQ_UNESCAPE = re.compile(r'\\(["\\$`])')
+
+def _dq_unescape(span: str) -> str:
+    return _DQ_UNESCAPE.sub(r'\1', span)
+
+@functools.lru_cache(maxsize=256)
+def _parse_command_line_cached(line: str):
     tokens = []
-    current = []
-    in_single = False
-    in_double = False
-    i = 0
-    while i < len(line):
-        c = line[i]
-        if in_single:
-            if c == "'":
-                in_single = False
+    for match in _TOKEN_RE.finditer(line):
+        pieces = []
+        for seg in _SEGMENT_RE.finditer(match.group()):
+            single, double, plain = seg.groups()
+            if single is not None:
+                pieces.append(single)
+            elif double is not None:
+                pieces.append(_dq_unescape(double))
+            elif plain.startswith('\\'):
+                pieces.append(plain[1:])
             else:
-                current.append(c)
-            i += 1
-            continue
-        if in_double:
-            if c == '"':
-                in_double = False
-                i += 1
-                continue
-            if c == '\\':
-                i += 1
-                if i < len(line):
-                    next_c = line[i]
-                    if next_c in ['"', '\\', '$', '`']:
-                        current.append(next_c)
-                    else:
-                        current.append('\\')
-                        current.append(next_c)
-                    i += 1
-                continue
-            current.append(c)
-            i += 1
-            continue
-        if c.isspace():
-            if current:
-                tokens.append(''.join(current))
-                current = []
-            i += 1
-            while i < len(line) and line[i].isspace():
-                i += 1
-            continue
-        if c == "'":
-            in_single = True
-            i += 1
-            continue
-        if c == '"':
-            in_double = True
-            i += 1
-            continue
-        if c == '\\':
-            i += 1
-            if i < len(line):
-                current.append(line[i])
-                i += 1
-            continue
-        current.append(c)
-        i += 1
-    if current:
-        tokens.append(''.join(current))
-    return tokens
+                pieces.append(plain)
+        token = ''.join(pieces)
+        if token:
+            tokens.append(token)
+    return tuple(tokens)
+
+def parse_command_line(line: str) -> List[str]:
+    # Re-entered lines (history replay, repeated commands, pipeline stages)
+    # hit the cache and skip tokenization entirely. The cache holds tuples;
+    # hand each caller a fresh list so the cached value stays immutable.
+    return list(_parse_command_line_cached(line))
+
+# Standalone operators take the next token as target; attached forms
+# (e.g. "2>>file") carry it in the same token. Prefixes are ordered
+# longest-first so "1>>" wins over "1>". Plain ">" with nothing attached
+# is never a prefix form.
+_REDIR_EXACT = {
+    ">": ("out", False), "1>": ("out", False),
+    ">>": ("out", True), "1>>": ("out", True),
+    "2>": ("err", False), "2>>": ("err", True),
+}
+_REDIR_PREFIXES = (
+    ("1>>", 3, "out", True),
+    (">>", 2, "out", True),
+    ("2>>", 3, "err", True),
+    ("1>", 2, "out", False),
+    ("2>", 2, "err", False),
+)
 
 def split_redirection(parts: List[str]):
+    # Fast path: every operator contains '>', so a command with none
+    # anywhere (the common case) needs no token walk at all.
+    for part in parts:
+        if '>' in part:
+            break
+    else:
+        return parts, None, False, None, False
     cmd_args = []
     stdout_redir_file = None
     stdout_append = False
     stderr_redir_file = None
     stderr_append = False
     i = 0
-    while i < len(parts):
+    n = len(parts)
+    while i < n:
         part = parts[i]
-        if part in ("1>>", ">>"):
-            if i + 1 < len(parts):
-                stdout_redir_file = parts[i + 1]
-                stdout_append = True
-                i += 2
-                continue
-        if part in ("1>", ">"):
-            if i + 1 < len(parts):
+        info = _REDIR_EXACT.get(part)
+        if info is not None and i + 1 < n:
+            stream, append = info
+            if stream == "out":
                 stdout_redir_file = parts[i + 1]
-                stdout_append = False
-                i += 2
-                continue
-        if part == "2>>":
-            if i + 1 < len(parts):
-                stderr_redir_file = parts[i + 1]
-                stderr_append = True
-                i += 2
-                continue
-        if part == "2>":
-            if i + 1 < len(parts):
+                stdout_append = append
+            else:
                 stderr_redir_file = parts[i + 1]
-                stderr_append = False
-                i += 2
-                continue
-        if part.startswith("1>>"):
-            stdout_redir_file = part[3:]
-            stdout_append = True
-            i += 1
-            continue
-        if part.startswith(">>"):
-            stdout_redir_file = part[2:]
-            stdout_append = True
-            i += 1
-            continue
-        if part.startswith("1>"):
-            stdout_redir_file = part[2:]
-            stdout_append = False
-            i += 1
-            continue
-        if part.startswith("2>>"):
-            stderr_redir_file = part[3:]
-            stderr_append = True
-            i += 1
-            continue
-        if part.startswith("2>"):
-            stderr_redir_file = part[2:]
-            stderr_append = False
-            i += 1
+                stderr_append = append
+            i += 2
             continue
-        cmd_args.append(part)
+        for prefix, plen, stream, append in _REDIR_PREFIXES:
+            if part.startswith(prefix):
+                if stream == "out":
+                    stdout_redir_file = part[plen:]
+                    stdout_append = append
+                else:
+                    stderr_redir_file = part[plen:]
+                    stderr_append = append
+                break
+        else:
+            cmd_args.append(part)
         i += 1
     return cmd_args, stdout_redir_file, stdout_append, stderr_redir_file, stderr_append
 
@@ -218,30 +304,41 @@ def write_out(msg: str, stdout_redir_file=None, append=False, stderr_redir_file=
         print(msg)
 
 # --- Readline completer -----------------------------------------------------
+_listing_cache = {}  # directory -> (st_mtime_ns, sorted entry names)
+
+def _dir_entries(dirpath: str):
+    """Sorted names in dirpath, rescanned only when its mtime changes."""
+    try:
+        mtime = os.stat(dirpath).st_mtime_ns
+    except OSError:
+        return None
+    cached = _listing_cache.get(dirpath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with os.scandir(dirpath) as it:
+            names = sorted(entry.name for entry in it)
+    except Exception:
+        return None
+    _listing_cache[dirpath] = (mtime, names)
+    return names
+
 def _complete_filenames(prefix: str) -> List[str]:
     if '/' in prefix:
         dirpart, basepart = prefix.rsplit('/', 1)
-        if dirpart == '':
-            dirpath = '/'
-        else:
-            dirpath = dirpart
-        try:
-            entries = os.listdir(dirpath)
-        except Exception:
-            return []
-        matches = []
-        for e in entries:
-            if e.startswith(basepart):
-                candidate = os.path.join(dirpart, e)
-                matches.append(candidate)
-        return sorted(matches)
+        dirpath = '/' if dirpart == '' else dirpart
     else:
-        try:
-            entries = os.listdir(os.getcwd())
-        except Exception:
-            return []
-        matches = [e for e in entries if e.startswith(prefix)]
-        return sorted(matches)
+        dirpart, basepart = None, prefix
+        dirpath = _tick_cwd if _tick_cwd is not None else os.getcwd()
+    entries = _dir_entries(dirpath)
+    if entries is None:
+        return []
+    # Sorted entries make the prefix range contiguous; bisect it out.
+    lo = bisect.bisect_left(entries, basepart)
+    hi = bisect.bisect_left(entries, basepart + '\uffff')
+    if dirpart is None:
+        return entries[lo:hi]
+    return [os.path.join(dirpart, e) for e in entries[lo:hi]]
 
 def external_and_builtin_completer(text: str, state: int):
     matches = []
@@ -251,9 +348,12 @@ def external_and_builtin_completer(text: str, state: int):
         for cmd in builtins:
             if cmd.startswith(text):
                 matches.append(cmd)
-        for exec_name in get_path_executables():
-            if exec_name.startswith(text) and exec_name not in builtins:
-                matches.append(exec_name)
+        # get_path_executables is sorted, so the entries sharing this prefix
+        # form a contiguous range findable by bisection.
+        execs = get_path_executables()
+        lo = bisect.bisect_left(execs, text)
+        hi = bisect.bisect_left(execs, text + '\uffff')
+        matches.extend(e for e in execs[lo:hi] if e not in _builtin_set)
         matches = sorted(matches)
     if not matches:
         return None
@@ -274,6 +374,61 @@ def setup_readline():
     readline.parse_and_bind('tab: complete')
 
 # --- Pipeline / process execution -------------------------------------------
+# Builtins that only produce output and touch no shell state; their stage
+# output can be computed in the parent without forking a child.
+_PURE_OUTPUT_BUILTINS = frozenset(("echo", "type", "pwd", "history"))
+
+def _builtin_output(cmd: str, args: List[str]) -> str:
+    if cmd == "echo":
+        output = " ".join(args)
+        return output + ("\n" if not output.endswith("\n") else "")
+    if cmd == "type":
+        if len(args) == 0:
+            return ""
+        target = args[0]
+        if target in _builtin_set:
+            return f"{target} is a shell builtin\n"
+        executable_path = find_executable(target)
+        if executable_path:
+            return f"{target} is {executable_path}\n"
+        return f"{target}: not found\n"
+    if cmd == "pwd":
+        return os.getcwd() + "\n"
+    if cmd == "history":
+        n_arg = None
+        if args:
+            try:
+                n_arg = int(args[0])
+            except Exception:
+                n_arg = None
+        total = len(history_list)
+        if n_arg is None:
+            start_idx = 1
+        else:
+            start_idx = max(1, total - n_arg + 1)
+        return "".join(f"    {idx}  {entry}\n"
+                       for idx, entry in enumerate(islice(history_list, start_idx - 1, None),
+                                                   start_idx))
+    return ""
+
+class Stage:
+    """One pipeline stage; slots keep attribute access off the dict path."""
+    __slots__ = ("args", "stdout_redir", "stdout_append", "stderr_redir",
+                 "stderr_append", "is_builtin", "exec_path", "stdout_f",
+                 "stderr_f")
+
+    def __init__(self, cmd_args, stdout_redir, stdout_append,
+                 stderr_redir, stderr_append):
+        self.args = cmd_args
+        self.stdout_redir = stdout_redir
+        self.stdout_append = stdout_append
+        self.stderr_redir = stderr_redir
+        self.stderr_append = stderr_append
+        self.is_builtin = cmd_args[0] in _builtin_set
+        self.exec_path = None
+        self.stdout_f = None
+        self.stderr_f = None
+
 def execute_pipeline(stages_parts: List[List[str]]):
     if not stages_parts:
         return
@@ -284,22 +439,13 @@ def execute_pipeline(stages_parts: List[List[str]]):
          stderr_redir_file, stderr_append) = split_redirection(parts)
         if not cmd_args:
             return
-        parsed.append({
-            "args": cmd_args,
-            "stdout_redir": stdout_redir_file,
-            "stdout_append": stdout_append,
-            "stderr_redir": stderr_redir_file,
-            "stderr_append": stderr_append,
-            "is_builtin": cmd_args[0] in builtins,
-            "exec_path": None,
-            "stdout_f": None,
-            "stderr_f": None
-        })
+        parsed.append(Stage(cmd_args, stdout_redir_file, stdout_append,
+                            stderr_redir_file, stderr_append))
     for p in parsed:
-        if not p["is_builtin"]:
-            p["exec_path"] = find_executable(p["args"][0])
-            if not p["exec_path"]:
-                write_err(f"{p['args'][0]}: command not found", None)
+        if not p.is_builtin:
+            p.exec_path = find_executable(p.args[0])
+            if not p.exec_path:
+                write_err(f"{p.args[0]}: command not found", None)
                 return
     def open_redir_file(path, append):
         if not path:
@@ -311,85 +457,36 @@ def execute_pipeline(stages_parts: List[List[str]]):
             write_err(f"Error preparing {path}: {e}", None)
             return None
     for p in parsed:
-        p["stdout_f"] = open_redir_file(p["stdout_redir"], p["stdout_append"])
-        p["stderr_f"] = open_redir_file(p["stderr_redir"], p["stderr_append"])
+        p.stdout_f = open_redir_file(p.stdout_redir, p.stdout_append)
+        p.stderr_f = open_redir_file(p.stderr_redir, p.stderr_append)
     n = len(parsed)
     pipes = []
     for i in range(n - 1):
         pipes.append(os.pipe())
     procs = []
     child_pids = []
+    pending_writes = []  # (pipe write fd, builtin output) flushed post-spawn
     def run_builtin_child(cmd, args):
         if cmd == "exit":
             os._exit(0)
-        elif cmd == "echo":
-            output = " ".join(args)
-            sys.stdout.write(output + ("\n" if not output.endswith("\n") else ""))
-            sys.stdout.flush()
-            os._exit(0)
-        elif cmd == "type":
-            if len(args) == 0:
-                os._exit(0)
-            target = args[0]
-            if target in builtins:
-                sys.stdout.write(f"{target} is a shell builtin\n")
-            else:
-                executable_path = find_executable(target)
-                if executable_path:
-                    sys.stdout.write(f"{target} is {executable_path}\n")
-                else:
-                    sys.stdout.write(f"{target}: not found\n")
-            sys.stdout.flush()
-            os._exit(0)
-        elif cmd == "pwd":
-            sys.stdout.write(os.getcwd() + "\n")
+        elif cmd in _PURE_OUTPUT_BUILTINS:
+            sys.stdout.write(_builtin_output(cmd, args))
             sys.stdout.flush()
             os._exit(0)
         elif cmd == "cd":
             if len(args) == 0:
                 os._exit(0)
             directory = args[0]
+            target = os.environ.get("HOME", "") if directory == "~" else directory
+            # chdir checks existence and type in-kernel; no isdir pre-stat.
             try:
-                if directory == "~":
-                    home = os.environ.get("HOME")
-                    if home and os.path.isdir(home):
-                        os.chdir(home)
-                    else:
-                        sys.stderr.write(f"cd: {directory}: No such file or directory\n")
-                elif directory.startswith("/"):
-                    if os.path.isdir(directory):
-                        os.chdir(directory)
-                    else:
-                        sys.stderr.write(f"cd: {directory}: No such file or directory\n")
-                else:
-                    target_path = os.path.join(os.getcwd(), directory)
-                    if os.path.isdir(target_path):
-                        os.chdir(target_path)
-                    else:
-                        sys.stderr.write(f"cd: {directory}: No such file or directory\n")
+                os.chdir(target)
+            except PermissionError:
+                sys.stderr.write(f"cd: {directory}: Permission denied\n")
             except Exception:
                 sys.stderr.write(f"cd: {directory}: No such file or directory\n")
             sys.stderr.flush()
             os._exit(0)
-        elif cmd == "history":
-            # Print history in child
-            n_arg = None
-            if args:
-                try:
-                    n_arg = int(args[0])
-                except Exception:
-                    n_arg = None
-            total = len(history_list)
-            if n_arg is None:
-                start_idx = 1
-            else:
-                start_idx = max(1, total - n_arg + 1)
-            idx = start_idx
-            for entry in history_list[start_idx - 1:]:
-                sys.stdout.write(f"    {idx}  {entry}\n")
-                idx += 1
-            sys.stdout.flush()
-            os._exit(0)
         else:
             sys.stderr.write(f"{cmd}: command not found\n")
             sys.stderr.flush()
@@ -403,10 +500,22 @@ def execute_pipeline(stages_parts: List[List[str]]):
             stdout_fd = None
         else:
             stdout_fd = pipes[i][1]
-        stdout_fobj = p["stdout_f"]
-        stderr_fobj = p["stderr_f"]
+        stdout_fobj = p.stdout_f
+        stderr_fobj = p.stderr_f
         try:
-            if p["is_builtin"]:
+            if p.is_builtin and p.args[0] in _PURE_OUTPUT_BUILTINS:
+                # Pure-output builtin: no fork, just compute the output in
+                # the parent. Pipe writes are deferred until every stage is
+                # spawned so a downstream reader exists to drain the pipe.
+                output = _builtin_output(p.args[0], p.args[1:])
+                if stdout_fobj:
+                    stdout_fobj.write(output)
+                elif stdout_fd is not None:
+                    pending_writes.append((stdout_fd, output.encode()))
+                else:
+                    sys.stdout.write(output)
+                    sys.stdout.flush()
+            elif p.is_builtin:
                 pid = os.fork()
                 if pid == 0:
                     if stdin_fd is not None:
@@ -417,16 +526,13 @@ def execute_pipeline(stages_parts: List[List[str]]):
                         os.dup2(stdout_fd, 1)
                     if stderr_fobj:
                         os.dup2(stderr_fobj.fileno(), 2)
-                    for (rfd, wfd) in pipes:
-                        try:
-                            os.close(rfd)
-                        except Exception:
-                            pass
-                        try:
-                            os.close(wfd)
-                        except Exception:
-                            pass
-                    run_builtin_child(p["args"][0], p["args"][1:])
+                    if pipes:
+                        # The needed ends are dup2'd onto 0-2 above, and pipe
+                        # fds always sit above stderr, so one closerange over
+                        # the whole span replaces a close call per fd.
+                        fds = [fd for pair in pipes for fd in pair]
+                        os.closerange(min(fds), max(fds) + 1)
+                    run_builtin_child(p.args[0], p.args[1:])
                 else:
                     child_pids.append(pid)
             else:
@@ -439,15 +545,25 @@ def execute_pipeline(stages_parts: List[List[str]]):
                     stdout_param = None
                 stderr_param = stderr_fobj if stderr_fobj else None
                 proc = subprocess.Popen(
-                    [p["exec_path"]] + p["args"][1:],
+                    [p.exec_path] + p.args[1:],
                     stdin=stdin_param,
                     stdout=stdout_param,
                     stderr=stderr_param,
                     close_fds=False
                 )
                 procs.append(proc)
+            # The child holds its own copy of any redirection fd now; close
+            # ours immediately rather than keeping it open until wait.
+            for fobj in (p.stdout_f, p.stderr_f):
+                if fobj:
+                    try:
+                        fobj.close()
+                    except Exception:
+                        pass
+            p.stdout_f = None
+            p.stderr_f = None
         except OSError as e:
-            write_err(f"Error starting command {p['args'][0]}: {e}", None)
+            write_err(f"Error starting command {p.args[0]}: {e}", None)
             for fobj in (stdout_fobj, stderr_fobj):
                 if fobj:
                     try:
@@ -464,10 +580,25 @@ def execute_pipeline(stages_parts: List[List[str]]):
                 except Exception:
                     pass
             return
-    for (rfd, wfd) in pipes:
+    # Close every pipe fd we still hold except the write ends queued for
+    # deferred builtin output; the readers own dup'd copies. Doing this
+    # before flushing lets a reader that exits early surface EPIPE instead
+    # of our own read-end copy keeping the pipe alive while os.write blocks.
+    pending_fds = {wfd for wfd, _ in pending_writes}
+    for pair in pipes:
+        for fd in pair:
+            if fd not in pending_fds:
+                try:
+                    os.close(fd)
+                except Exception:
+                    pass
+    for wfd, payload in pending_writes:
         try:
-            os.close(rfd)
-        except Exception:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(wfd, view):]
+        except OSError:
+            # Reader exited early (e.g. head); drop the rest like SIGPIPE would.
             pass
         try:
             os.close(wfd)
@@ -483,17 +614,10 @@ def execute_pipeline(stages_parts: List[List[str]]):
             os.waitpid(pid, 0)
         except Exception:
             pass
-    for p in parsed:
-        for f in (p.get("stdout_f"), p.get("stderr_f")):
-            if f:
-                try:
-                    f.close()
-                except Exception:
-                    pass
 
 # --- Main loop --------------------------------------------------------------
 def main():
-    global last_append_idx
+    global last_append_idx, last_saved_idx
     setup_readline()
 
     # Load history from HISTFILE at startup (if set)
@@ -505,45 +629,36 @@ def main():
                     line = line.rstrip("\n")
                     if line == "":
                         continue
-                    history_list.append(line)
+                    record_history(line)
                     try:
                         readline.add_history(line)
                     except Exception:
                         pass
         except Exception:
             pass
+        # Everything loaded is already on disk; only the tail needs saving.
+        last_saved_idx = history_total
 
     try:
         while True:
+            _refresh_tick()
             try:
                 line = input("$ ")
             except EOFError:
                 # Save history on exit if HISTFILE is set
-                if histfile:
-                    try:
-                        with open(histfile, "w") as f:
-                            for entry in history_list:
-                                f.write(entry + "\n")
-                    except Exception:
-                        pass
+                save_history_tail(histfile)
                 break
 
             if line is None:
                 continue
 
             if line.strip():
-                history_list.append(line)
+                record_history(line)
+                # add_history alone keeps readline in sync; no full resync needed.
                 try:
                     readline.add_history(line)
                 except Exception:
                     pass
-                # Keep readline synchronized fully
-                readline.clear_history()
-                for item in history_list:
-                    try:
-                        readline.add_history(item)
-                    except Exception:
-                        pass
 
             if not line:
                 continue
@@ -566,35 +681,30 @@ def main():
             if not cmd_parts:
                 continue
 
-            if stderr_redir_file:
-                try:
-                    if stderr_append:
-                        open(stderr_redir_file, 'a').close()
-                    else:
-                        open(stderr_redir_file, 'w').close()
-                except Exception as e:
-                    sys.stderr.write(f"Error preparing {stderr_redir_file}: {e}\n")
-            if stdout_redir_file:
-                try:
-                    if stdout_append:
-                        open(stdout_redir_file, 'a').close()
-                    else:
-                        open(stdout_redir_file, 'w').close()
-                except Exception as e:
-                    sys.stderr.write(f"Error preparing {stdout_redir_file}: {e}\n")
-
             command = cmd_parts[0]
             args = cmd_parts[1:]
 
+            # Builtins and the not-found path only open their redirection
+            # targets lazily, if at all (stderr always in append mode, stdout
+            # not at all for e.g. cd or history -w), so create/truncate them
+            # up front; external commands open them themselves with the
+            # right mode.
+            if ((stdout_redir_file or stderr_redir_file)
+                    and (command in _builtin_set or not find_executable(command))):
+                if stdout_redir_file:
+                    try:
+                        open(stdout_redir_file, 'a' if stdout_append else 'w').close()
+                    except Exception as e:
+                        sys.stderr.write(f"Error preparing {stdout_redir_file}: {e}\n")
+                if stderr_redir_file:
+                    try:
+                        open(stderr_redir_file, 'a' if stderr_append else 'w').close()
+                    except Exception as e:
+                        sys.stderr.write(f"Error preparing {stderr_redir_file}: {e}\n")
+
             if command == "exit":
                 # Save history before exiting
-                if histfile:
-                    try:
-                        with open(histfile, "w") as f:
-                            for entry in history_list:
-                                f.write(entry + "\n")
-                    except Exception:
-                        pass
+                save_history_tail(histfile)
                 sys.exit(0)
 
             elif command == "echo":
@@ -635,38 +745,19 @@ def main():
                 if len(args) == 0:
                     continue
                 directory = args[0]
-                if directory == "~":
-                    home = os.environ.get("HOME")
-                    if home and os.path.isdir(home):
-                        try:
-                            os.chdir(home)
-                        except Exception:
-                            write_err(f"cd: {directory}: No such file or directory",
-                                      stderr_redir_file)
-                    else:
-                        write_err(f"cd: {directory}: No such file or directory",
-                                  stderr_redir_file)
-                elif directory.startswith("/"):
-                    if os.path.isdir(directory):
-                        try:
-                            os.chdir(directory)
-                        except Exception:
-                            write_err(f"cd: {directory}: No such file or directory",
-                                      stderr_redir_file)
-                    else:
-                        write_err(f"cd: {directory}: No such file or directory",
-                                  stderr_redir_file)
-                else:
-                    target_path = os.path.join(os.getcwd(), directory)
-                    if os.path.isdir(target_path):
-                        try:
-                            os.chdir(target_path)
-                        except Exception:
-                            write_err(f"cd: {directory}: No such file or directory",
-                                      stderr_redir_file)
-                    else:
-                        write_err(f"cd: {directory}: No such file or directory",
-                                  stderr_redir_file)
+                target = os.environ.get("HOME", "") if directory == "~" else directory
+                # chdir checks existence and type in-kernel, so the old
+                # isdir pre-stat (one per absolute/relative/~ arm) is gone.
+                try:
+                    os.chdir(target)
+                except PermissionError:
+                    write_err(f"cd: {directory}: Permission denied",
+                              stderr_redir_file)
+                except Exception:
+                    write_err(f"cd: {directory}: No such file or directory",
+                              stderr_redir_file)
+                # cwd (possibly) changed; refresh the tick snapshot.
+                _refresh_tick()
 
             elif command == "history":
                 if args and args[0] == "-r" and len(args) > 1:
@@ -677,18 +768,13 @@ def main():
                                 line = line.rstrip("\n")
                                 if line == "":
                                     continue
-                                history_list.append(line)
+                                record_history(line)
+                                # add_history per loaded line keeps readline in
+                                # sync; no clear + full re-add needed.
                                 try:
                                     readline.add_history(line)
                                 except Exception:
                                     pass
-                        # sync readline fully
-                        readline.clear_history()
-                        for item in history_list:
-                            try:
-                                readline.add_history(item)
-                            except Exception:
-                                pass
                     except Exception as e:
                         write_err(f"history -r: Cannot read {history_file}: {e}",
                                   stderr_redir_file)
@@ -698,8 +784,10 @@ def main():
                     history_file = args[1]
                     try:
                         with open(history_file, "w") as f:
-                            for entry in history_list:
-                                f.write(entry + "\n")
+                            if history_list:
+                                f.write("\n".join(history_list) + "\n")
+                        if history_file == histfile:
+                            last_saved_idx = history_total
                     except Exception as e:
                         write_err(f"history -w: Cannot write {history_file}: {e}",
                                   stderr_redir_file)
@@ -709,41 +797,30 @@ def main():
                     history_file = args[1]
                     try:
                         # Append only new commands since last_append_idx
+                        new_entries = list(_history_since(last_append_idx))
                         with open(history_file, "a") as f:
-                            for entry in history_list[last_append_idx:]:
-                                f.write(entry + "\n")
-                        last_append_idx = len(history_list)
+                            if new_entries:
+                                f.write("\n".join(new_entries) + "\n")
+                        last_append_idx = history_total
+                        if history_file == histfile:
+                            last_saved_idx = history_total
                     except Exception as e:
                         write_err(f"history -a: Cannot append {history_file}: {e}",
                                   stderr_redir_file)
                     continue
 
-                # Print history inline (normal history command)
-                n_arg = None
-                if args:
-                    try:
-                        n_arg = int(args[0])
-                    except Exception:
-                        n_arg = None
-                total = len(history_list)
-                if n_arg is None:
-                    start_idx = 1
-                else:
-                    start_idx = max(1, total - n_arg + 1)
-                idx = start_idx
+                # Print history (normal history command): build the whole
+                # payload once and emit it with a single write.
+                payload = _builtin_output("history", args)
                 if stdout_redir_file:
                     try:
                         mode = 'a' if stdout_append else 'w'
                         with open(stdout_redir_file, mode) as f:
-                            for entry in history_list[start_idx - 1:]:
-                                f.write(f"    {idx}  {entry}\n")
-                                idx += 1
+                            f.write(payload)
                     except Exception as e:
                         write_err(f"Error writing history: {e}", stderr_redir_file)
                 else:
-                    for entry in history_list[start_idx - 1:]:
-                        print(f"    {idx}  {entry}")
-                        idx += 1
+                    sys.stdout.write(payload)
             else:
                 executable_path = find_executable(command)
                 if executable_path:
@@ -753,12 +830,29 @@ def main():
                         stderr_f = (open(stderr_redir_file, 'a' if stderr_append else 'w')
                                     if stderr_redir_file else None)
                         try:
-                            subprocess.run(
-                                [command] + args,
-                                executable=executable_path,
-                                stdout=stdout_f if stdout_f else None,
-                                stderr=stderr_f if stderr_f else None,
-                            )
+                            if _HAVE_POSIX_SPAWN:
+                                # posix_spawn skips fork's copy of the
+                                # interpreter's page tables; redirections
+                                # become kernel-side dup2 file actions.
+                                file_actions = []
+                                if stdout_f:
+                                    file_actions.append(
+                                        (os.POSIX_SPAWN_DUP2, stdout_f.fileno(), 1))
+                                if stderr_f:
+                                    file_actions.append(
+                                        (os.POSIX_SPAWN_DUP2, stderr_f.fileno(), 2))
+                                pid = os.posix_spawn(
+                                    executable_path, [command] + args,
+                                    os.environ, file_actions=file_actions,
+                                    setsigdef=_SPAWN_SETSIGDEF)
+                                os.waitpid(pid, 0)
+                            else:
+                                subprocess.run(
+                                    [command] + args,
+                                    executable=executable_path,
+                                    stdout=stdout_f if stdout_f else None,
+                                    stderr=stderr_f if stderr_f else None,
+                                )
                         finally:
                             if stdout_f:
                                 stdout_f.close()
@@ -769,13 +863,7 @@ def main():
                 else:
                     write_err(f"{command}: command not found", stderr_redir_file)
     except KeyboardInterrupt:
-        if histfile:
-            try:
-                with open(histfile, "w") as f:
-                    for entry in history_list:
-                        f.write(entry + "\n")
-            except Exception:
-                pass
+        save_history_tail(histfile)
         sys.exit(0)
 
 if __name__ == "__main__":